@@ -1,16 +1,25 @@
+from aiolimiter import AsyncLimiter
+import asyncio
+import atexit
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
 import csv
-from datetime import datetime
+import gzip
+import httpx
 import io
+import json
 import logging
-from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener
+from operator import itemgetter
+import queue
 import re
-import requests
-from requests.exceptions import RequestException
 import retriever as rt
+import sqlite3
 import sys
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+import threading
 import time
-from urllib.parse import urlparse
 
 # This script takes a list of homepages scraped from data.cdc.gov sitemaps and a list of downloaded datasets obtained from those homepages
 # and builds spreadsheet-friendly documentation for those datasets.
@@ -23,6 +32,49 @@ from urllib.parse import urlparse
 sitemap_data_fname = 'cdc_data_sitemap_data.csv'
 downloads_fname = 'cdc_data_downloads.csv'
 log_fname = "dataset_doc.log"
+# the documentation is written gzipped; level 1 is cheap on CPU and still shrinks text csv a lot
+output_fname = 'dataset_documentation.csv.gz'
+output_compresslevel = 1
+output_buffer_size = 1 << 20
+
+# downloaded filenames look like SSSS-SSSS_TS.TS_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX, and socrata ids look like xxxx-xxxx
+download_filename_pattern = re.compile(r"(?P<socrata_id>[a-zA-Z0-9]+-[a-zA-Z0-9]+)_(?P<timestamp>\d+\.\d+)_")
+socrata_id_pattern = re.compile(r"^[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}$")
+
+# the lookups are network-bound, so run many homepages at once, but cap how many requests
+# are in flight against each host so we stay polite
+ia_concurrency = 8
+socrata_concurrency = 4
+ia_semaphore = asyncio.Semaphore(ia_concurrency)
+socrata_semaphore = asyncio.Semaphore(socrata_concurrency)
+# ... and pace the requests to each host so we only wait as long as we need to
+ia_limiter = AsyncLimiter(max_rate=6, time_period=60)
+socrata_limiter = AsyncLimiter(max_rate=10, time_period=60)
+# if a host tells us to slow down anyway, back off exponentially before trying again
+retry_statuses = (429, 503)
+retry_max_attempts = 5
+retry_wait_multiplier_secs = 10
+retry_wait_max_secs = 300
+
+# reuse one set of keep-alive connections for every request so we only pay for the TLS handshake once per host
+http_timeout_secs = 30
+http_limits = httpx.Limits(max_keepalive_connections=32)
+http_headers = { 'User-Agent': 'data.cdc.gov-metadata (https://github.com/YakShavingAsAService/data.cdc.gov-metadata)' }
+# the root logger is at DEBUG, and the HTTP/2 stack logs every connection step and header at that level,
+# on top of httpx's own line for every request
+for http_logger_name in ('hpack', 'httpcore', 'h2', 'httpx'):
+	logging.getLogger(http_logger_name).setLevel(logging.WARNING)
+
+# keep good IA and socrata answers on disk so a rerun doesn't have to fetch everything again
+cache_fname = 'cdc_meta_cache.sqlite'
+cache_expire_secs = 86400 * 7
+# ... and within a run, look each homepage up in the IA only once
+ia_snapshot_tasks = {} # homepage url -> task looking up its IA snapshots
+
+# the socrata catalog api takes many ids per call, so look them up in batches instead of one at a time
+socrata_catalog_url = "https://api.us.socrata.com/api/catalog/v1"
+socrata_batch_size = 100
+socrata_lookups = {} # socrata id -> (socrata metadata, anything the api printed to stdout)
 
 header_text = '''This is supplementary information for a series of data.cdc.gov dataset snapshots taken in January 2025.
 Methodology notes:        
@@ -46,13 +98,40 @@ file_handler = logging.FileHandler(log_fname, mode='w')
 file_handler.setFormatter(formatter)
 stream_handler = logging.StreamHandler(sys.stdout)
 stream_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+# the handlers write from a background thread, so logging a record is just a put on this queue
+log_queue = queue.Queue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, file_handler, stream_handler)
+log_listener.start()
+# stop() drains whatever is still on the queue, so nothing gets lost at exit
+atexit.register(log_listener.stop)
 
 #logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename = log_fname, filemode = 'w')
 
-logging.info("documenting datasets downloaded in %s" % downloads_fname)
-logging.info("dataset homepages are in %s" % sitemap_data_fname)
+logging.info("documenting datasets downloaded in %s", downloads_fname)
+logging.info("dataset homepages are in %s", sitemap_data_fname)
+
+# response cache setup. the socrata lookups run in worker threads, so share one connection behind a lock
+cache_lock = threading.Lock()
+cache_db = sqlite3.connect(cache_fname, check_same_thread=False)
+cache_db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, fetched_ts REAL)")
+
+def cache_get( key ):
+	"""
+	return the cached value for this key, or None if it's not cached or is older than cache_expire_secs.
+	"""
+	with cache_lock:
+		row = cache_db.execute("SELECT value, fetched_ts FROM responses WHERE key = ?", (key,)).fetchone()
+	if row and time.time() - row[1] < cache_expire_secs:
+		return row[0]
+	return None
+
+def cache_put( key, value ):
+	"""
+	save this value in the cache under this key, replacing whatever was there.
+	"""
+	with cache_lock, cache_db:
+		cache_db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, value, time.time()))
 
 def build_download_file_dict():
 	"""
@@ -66,77 +145,274 @@ def build_download_file_dict():
 	the dictionary value can have more than one inner dictionary in it.
 	"""
 
-	results_dict = {}
-	pattern = r"^(?P<socrata_id>[a-zA-Z0-9]+-[a-zA-Z0-9]+)_(?P<timestamp>\d+\.\d+)_"
+	results_dict = defaultdict(list)
 	with open(downloads_fname,'r') as downloadsf:
-		while True:
-			line = downloadsf.readline()
-			line = line.rstrip()
-			if not line: break
+		for raw_line in downloadsf:
+			line = raw_line.rstrip()
+			if not line: continue
 
-			match = re.search(pattern, line)
+			match = download_filename_pattern.match(line)
 			if not match:
-				logging.error("this downloaded file name %s cannot be mapped to a socrata_id?!? skipping it" % (line))
-				pass
-			else:
-				socrata_id = match.group('socrata_id')
-				ts = match.group('timestamp')
-				# take this UNIX timestamp with fractional seconds and turn it
-				# into a reasonable-looking UTC string
-				ts_float = float(ts)
-				utc_time = datetime.utcfromtimestamp(ts_float)
-				download_ts = utc_time.strftime("%Y-%m-%d %H:%M:%S UTC")
-				if socrata_id in results_dict.keys():
-					logging.info("this socrata id %s appears more than once in %s?!?" % (socrata_id,downloads_fname))
-					results_dict[ socrata_id ].append( { 'download_filename': line, 'download_ts': download_ts } )
-				else:
-					results_dict[ socrata_id ] = [ { 'download_filename': line, 'download_ts': download_ts } ]
-	return results_dict
-
-def get_next_homepage_url_line( inputf ):
+				logging.error("this downloaded file name %s cannot be mapped to a socrata_id?!? skipping it", line)
+				continue
+
+			socrata_id = match.group('socrata_id')
+			ts = match.group('timestamp')
+			# take this UNIX timestamp with fractional seconds and turn it
+			# into a reasonable-looking UTC string
+			tm = time.gmtime(float(ts))
+			download_ts = f"{tm.tm_year:04d}-{tm.tm_mon:02d}-{tm.tm_mday:02d} {tm.tm_hour:02d}:{tm.tm_min:02d}:{tm.tm_sec:02d} UTC"
+			if socrata_id in results_dict:
+				logging.info("this socrata id %s appears more than once in %s?!?", socrata_id,downloads_fname)
+			results_dict[ socrata_id ].append( { 'download_filename': line, 'download_ts': download_ts } )
+	# hand back a plain dict, so looking up an id that wasn't downloaded can't add it
+	return dict( results_dict )
+
+def get_homepage_urls( inputf ):
 	""""
-	gets the next line in the sitemaps input file and parses it into a dict. 
+	reads the lines in the sitemaps input file and parses each one into a dict. 
 	expected format: sitemaps_url_where_the_homepage_url_was_found,homepage_url
 	the last component in a homepage_urls should be a socrata id, which looks like: xxxx-xxxx
 
-	this function returns a dictionary that looks like:
+	this function yields dictionaries that look like:
 	{ 'socrata_id': socrata_id, 'homepage_url': homepage_url }
 	it is possible a socrata_id was not found, in whch case the dict looks
 	like: { 'socrata_id':None, 'homepage_url': homepage_url }
-	when the end of file is reached, returns None	
 	"""
-	line = inputf.readline()
-	line = line.rstrip()
-	if not line: return None
+	for row in csv.reader(inputf):
+		if not row: continue
+		if len(row) < 2:
+			logging.error("could not find a homepage url in this sitemaps file line %s ???", row)
+			continue
+
+		# the sitemap url doesn't have commas in it, so anything after the first one is the homepage url
+		(sitemap_url,homepage_url) = (row[0],','.join(row[1:]))
+		# the socrata id is the last component of the url's path, so drop any query or fragment first
+		socrata_id = homepage_url.partition('?')[0].partition('#')[0].rstrip('/').rpartition('/')[2]
 
-	(sitemap_url,homepage_url) = line.split(',')
-	parsed_url = urlparse(homepage_url)
-	path = parsed_url.path
-	socrata_id = Path(path).name
+		if not is_socrata_id(socrata_id):
+			logging.error("could not find a socrata id in %s ???", homepage_url)
+			yield { 'socrata_id': None, 'homepage_url': homepage_url }
+			continue
 
-	if not is_socrata_id(socrata_id):
-		logging.error("could not find a socrata id in %s ???" % (homepage_url))
-		return { 'socrata_id': None, 'homepage_url': homepage_url }
+		yield { 'socrata_id': socrata_id, 'homepage_url': homepage_url }
 
-	return { 'socrata_id': socrata_id, 'homepage_url': homepage_url }
+class RateLimitedError(Exception):
+	"""
+	a host answered with one of the retry_statuses, asking us to slow down.
+	"""
+	pass
 
-def get_internet_archive_snapshots( homepage_url ):
+def rate_limit_retrying():
+	"""
+	returns a tenacity retrier that backs off exponentially when a host raises RateLimitedError.
+	"""
+	return AsyncRetrying( retry=retry_if_exception_type(RateLimitedError),
+		wait=wait_exponential(multiplier=retry_wait_multiplier_secs, max=retry_wait_max_secs),
+		stop=stop_after_attempt(retry_max_attempts), reraise=True )
+
+async def get_internet_archive_snapshots( client, homepage_url ):
 	"""
 	return a list of saved snapshots of the homepage url in the internet archive.
+	the first call for a url starts the lookup, and any later calls for the same url share it.
 	"""
-	memento_url = "http://web.archive.org/web/timemap/link/%s" % homepage_url
+	task = ia_snapshot_tasks.get( homepage_url )
+	if task is None:
+		task = ia_snapshot_tasks[ homepage_url ] = asyncio.create_task( fetch_internet_archive_snapshots( client, homepage_url ) )
+	return await task
 
-	try:
-		response = requests.get( memento_url )
-		if response.status_code == 200:
-			return response.text
-		else:
-			logging.error("could not lookup IA snapshots using this url %s: %s" % (memento_url,str(response)))
-	except Exception as e:
-		print(f"error %s occurred using this url: %s " % (e,memento_url))
+async def fetch_internet_archive_snapshots( client, homepage_url ):
+	"""
+	look up the saved snapshots of the homepage url in the internet archive.
+	if the IA rate limits us, back off and try again.
+	"""
+	memento_url = "https://web.archive.org/web/timemap/link/%s" % homepage_url
+
+	cached = cache_get( memento_url )
+	if cached is not None:
+		return cached
+
+	async with ia_semaphore:
+		try:
+			async for attempt in rate_limit_retrying():
+				with attempt:
+					async with ia_limiter:
+						response = await client.get( memento_url )
+					if response.status_code in retry_statuses:
+						logging.info("IA asked us to slow down on %s: %s", memento_url,response)
+						raise RateLimitedError(memento_url)
+					if response.status_code == 200:
+						cache_put( memento_url, response.text )
+						return response.text
+					logging.error("could not lookup IA snapshots using this url %s: %s", memento_url,response)
+		except RateLimitedError:
+			logging.error("gave up looking up IA snapshots using this url %s after %d attempts", memento_url,retry_max_attempts)
+		except Exception as e:
+			print(f"error %s occurred using this url: %s " % (e,memento_url))
 
 	return ""
 
+def socrata_cache_key( socrata_id ):
+	# bump the version when the shape of the cached socrata metadata changes, so stale answers aren't reused
+	return "socrata-v2:%s" % socrata_id
+
+def is_good_socrata_meta( socrata_meta ):
+	"""
+	is this socrata metadata worth caching? only non-empty answers without an error are, so failed lookups
+	get retried on the next run.
+	"""
+	return bool(socrata_meta) and 'error' not in socrata_meta
+
+def socrata_catalog_result_to_meta( result ):
+	"""
+	turn one entry in the socrata catalog api's results into what rt.find_socrata_dataset_by_id would have given us
+	for that id, following the same branches as retriever 3.1.0. returns a tuple of (socrata metadata, stdout):
+	- maps and non-tabular resources: ({'error': 'Dataset cannot be downloaded using Socrata API', 'datatype': [type, lens_view_type]}, "")
+	- tabular resources without columns: ({}, the "Try downloading using its parent id" message retriever prints)
+	- everything else: ({'name': ..., 'id': ..., 'description': ..., 'datatype': lens_view_type, 'keywords': [...], 'domain': ..., 'homepage': ...}, "")
+	"""
+	resource = result['resource']
+	if resource['lens_view_type'] != "tabular" or resource['type'] == "map":
+		return { 'error': "Dataset cannot be downloaded using Socrata API", 'datatype': [resource['type'], resource['lens_view_type']] }, ""
+
+	if len(resource['columns_name']) == 0:
+		socrata_stdout = "Cannot download the dataset using %s\nTry downloading using its parent id : %s\n" % (resource['id'],resource['parent_fxf'][0])
+		return {}, socrata_stdout
+
+	socrata_meta = {}
+	socrata_meta['name'] = resource['name']
+	socrata_meta['id'] = resource['id']
+	socrata_meta['description'] = resource['description']
+	socrata_meta['datatype'] = resource['lens_view_type']
+	socrata_meta['keywords'] = list( set( result['classification']['categories'] + result['classification']['tags'] ) ) + ['socrata']
+	socrata_meta['domain'] = result['metadata']['domain']
+	socrata_meta['homepage'] = result['link']
+	return socrata_meta, ""
+
+async def fetch_socrata_catalog_batch( client, socrata_ids ):
+	"""
+	look up a batch of socrata ids with a single call to the socrata catalog api.
+	returns a dictionary of socrata id -> (socrata metadata, stdout) for the ids the api knows about.
+	"""
+	params = { 'ids': socrata_ids, 'limit': len(socrata_ids) }
+	ret = {}
+
+	async with socrata_semaphore:
+		try:
+			async for attempt in rate_limit_retrying():
+				with attempt:
+					async with socrata_limiter:
+						response = await client.get( socrata_catalog_url, params=params )
+					if response.status_code in retry_statuses:
+						logging.info("socrata asked us to slow down on a batch of %d ids: %s", len(socrata_ids),response)
+						raise RateLimitedError(socrata_catalog_url)
+					if response.status_code != 200:
+						logging.error("could not look up a batch of %d socrata ids: %s", len(socrata_ids),response)
+						return ret
+					for result in response.json()['results']:
+						ret[ result['resource']['id'] ] = socrata_catalog_result_to_meta( result )
+		except RateLimitedError:
+			logging.error("gave up looking up a batch of %d socrata ids after %d attempts", len(socrata_ids),retry_max_attempts)
+		except Exception as e:
+			logging.error("error %s occurred looking up a batch of %d socrata ids", e,len(socrata_ids))
+
+	return ret
+
+async def prefetch_socrata_data( client, socrata_ids ):
+	"""
+	fill in socrata_lookups for all of these socrata ids, from the cache if we can and otherwise from the
+	socrata catalog api, socrata_batch_size ids per call.
+	ids the catalog api doesn't return get looked up one at a time with retriever.
+	"""
+	uncached_ids = []
+	for socrata_id in sorted( socrata_ids ):
+		cached = cache_get( socrata_cache_key(socrata_id) )
+		if cached is not None:
+			socrata_lookups[ socrata_id ] = tuple( json.loads(cached) )
+		else:
+			uncached_ids.append( socrata_id )
+
+	batches = [ uncached_ids[i:i + socrata_batch_size] for i in range(0, len(uncached_ids), socrata_batch_size) ]
+	logging.info("looking up %d socrata ids in %d batches; %d were already cached", len(uncached_ids),len(batches),len(socrata_lookups))
+	for batch_results in await asyncio.gather( *[ fetch_socrata_catalog_batch( client, batch ) for batch in batches ] ):
+		for socrata_id, (socrata_meta, socrata_stdout) in batch_results.items():
+			socrata_lookups[ socrata_id ] = ( socrata_meta, socrata_stdout )
+			if is_good_socrata_meta( socrata_meta ):
+				cache_put( socrata_cache_key(socrata_id), json.dumps([socrata_meta, socrata_stdout]) )
+
+	# whatever the catalog api didn't give us, look up one id at a time in worker threads so the waits overlap
+	missing_ids = [ socrata_id for socrata_id in uncached_ids if socrata_id not in socrata_lookups ]
+	if missing_ids:
+		logging.info("looking up %d socrata ids the catalog api didn't return one at a time", len(missing_ids))
+		lookups = await find_socrata_datasets_by_id( missing_ids )
+		socrata_lookups.update( zip(missing_ids, lookups) )
+
+class ThreadStdout( io.TextIOBase ):
+	"""
+	a stand-in for sys.stdout that sends what each thread prints to that thread's own capture buffer, if it has one,
+	and to the real stdout otherwise. redirect_stdout swaps the process-wide sys.stdout, so this lets worker threads
+	capture what the socrata api prints without stepping on each other.
+	"""
+	def __init__( self, stdout ):
+		self.stdout = stdout
+		self.local = threading.local()
+
+	def write( self, s ):
+		if getattr(self.local, 'capturing', False):
+			return self.local.buffer.write(s)
+		return self.stdout.write(s)
+
+	def flush( self ):
+		self.stdout.flush()
+
+	@contextlib.contextmanager
+	def capture( self ):
+		"""
+		capture what this thread prints into this thread's buffer for the duration of the with block.
+		each thread reuses the same buffer, so read it before that thread's next capture.
+		"""
+		if not hasattr(self.local, 'buffer'):
+			self.local.buffer = io.StringIO()
+		self.local.buffer.seek(0)
+		self.local.buffer.truncate()
+		self.local.capturing = True
+		try:
+			yield self.local.buffer
+		finally:
+			self.local.capturing = False
+
+thread_stdout = ThreadStdout(sys.stdout)
+
+async def find_socrata_datasets_by_id( socrata_ids ):
+	"""
+	look up each of these socrata ids with find_socrata_dataset_by_id in worker threads.
+	returns a list of (socrata metadata, stdout) tuples in the same order as socrata_ids.
+	"""
+	with contextlib.redirect_stdout(thread_stdout), ThreadPoolExecutor(max_workers=socrata_concurrency) as executor:
+		return await asyncio.gather( *[ find_socrata_dataset_by_id_in_thread( executor, socrata_id ) for socrata_id in socrata_ids ] )
+
+async def find_socrata_dataset_by_id_in_thread( executor, socrata_id ):
+	"""
+	run find_socrata_dataset_by_id for this id in one of the executor's threads, holding to the same
+	socrata_semaphore and socrata_limiter as the catalog batches so we stay polite to the socrata api.
+	"""
+	async with socrata_semaphore, socrata_limiter:
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor( executor, find_socrata_dataset_by_id, socrata_id )
+
+def find_socrata_dataset_by_id( socrata_id ):
+	"""
+	look up the socrata metadata for this id with retriever.
+	returns a tuple of (socrata metadata, anything the api printed to stdout).
+	"""
+	with thread_stdout.capture() as stdout_buffer:
+		socrata_meta = rt.find_socrata_dataset_by_id(socrata_id)
+	socrata_stdout = stdout_buffer.getvalue()
+
+	if is_good_socrata_meta( socrata_meta ):
+		cache_put( socrata_cache_key(socrata_id), json.dumps([socrata_meta, socrata_stdout]) )
+	return socrata_meta, socrata_stdout
+
 def get_socrata_data( socrata_id ):
 	"""
 	look up this socrata id and retieve the associated socrata metadata.
@@ -148,165 +424,177 @@ def get_socrata_data( socrata_id ):
 	ret['soc_name'] = "UNKN_SOC_NAME"
 	ret['soc_homepage'] = ""
 	ret['soc_description'] = ""
-	# find the socrata metadata associated with this socrata id
-	stdout_buffer = io.StringIO()
-	with contextlib.redirect_stdout(stdout_buffer):
-		socrata_meta = rt.find_socrata_dataset_by_id(socrata_id)
-	socrata_stdout = stdout_buffer.getvalue()
+	# find the socrata metadata associated with this socrata id; prefetch_socrata_data already looked it up
+	(socrata_meta, socrata_stdout) = socrata_lookups.get( socrata_id, ({}, "") )
 	if socrata_stdout != "":
-		logging.info("socrata call to %s returned this string to stdout: %s " % (socrata_id, socrata_stdout))
+		logging.info("socrata call to %s returned this string to stdout: %s ", socrata_id, socrata_stdout)
 
 	# did we not get socrata metadata back at all? maybe there's some explanatory stdout from the api. capture that.
 	if not socrata_meta:
-		logging.error("could not find matching socrata metadata for socrata id %s, but got this: %s??" % (socrata_id,socrata_stdout))
+		logging.error("could not find matching socrata metadata for socrata id %s, but got this: %s??", socrata_id,socrata_stdout)
 		ret['socrata_meta'] = socrata_stdout
 	# or maybe we got socrata metadata back, but it came with an error message?
-	elif 'error' in socrata_meta.keys():
-		logging.error('socrata API call with id %s gave me an error: %s??' % (socrata_id,str(socrata_meta)))
-		if 'name' in socrata_meta.keys():
+	elif 'error' in socrata_meta:
+		logging.error('socrata API call with id %s gave me an error: %s??', socrata_id,socrata_meta)
+		if 'name' in socrata_meta:
 			ret['soc_name'] = socrata_meta['name']
 		ret['socrata_meta'] = str(socrata_meta)
 	# or maybe we got a normal response that looks something like this?
 	# {'name': 'dhds_dataset', 'id': '9vgf-r2z6', 'description': '', 'datatype': 'tabular', 'keywords': ['socrata'], 'domain': 'data.cdc.gov', 'homepage': 'https://data.cdc.gov/dataset/dhds_dataset/9vgf-r2z6'}
 	else:
-		if 'name' in socrata_meta.keys():
+		if 'name' in socrata_meta:
 			ret['soc_name'] = socrata_meta['name']
-		if 'homepage' in socrata_meta.keys():
+		if 'homepage' in socrata_meta:
 			ret['soc_homepage'] = socrata_meta['homepage']
-		if 'description' in socrata_meta.keys():
+		if 'description' in socrata_meta:
 			ret['soc_description'] = socrata_meta['description']
 		ret['socrata_meta'] = str(socrata_meta)
 
-	logging.debug("matched socrata id %s to socrata meta data: %s " % (socrata_id,ret['socrata_meta']))
+	logging.debug("matched socrata id %s to socrata meta data: %s ", socrata_id,ret['socrata_meta'])
 	return ret
 
-def process_leftover_download_files(parsed_download_file_dict,download_files_processed):
+async def process_homepage( client, socrata_task, parsed_homepage_url ):
 	"""
-	some datasets in the download file might not have corresponding entry in the datasets homepages in the sitemaps file.
-	process these "leftover" files separately
+	look up the IA snapshots, socrata metadata, and download files for one parsed homepage from the sitemaps file.
+	socrata_task is the running prefetch_socrata_data task.
+	returns a list of values dictionaries for the homepage, one per download file, or an empty list if it's not a dataset homepage.
 	"""
-	ret = []
-	for socrata_id in parsed_download_file_dict.keys():
-		if socrata_id not in download_files_processed:
-			logging.error("download file %s not in dataset home page file. going to process what we can still get now." % socrata_id)
-			values = {}
-			values['socrata_id'] = socrata_id
-			values['homepage'] = ""
-			values.update( get_socrata_data( socrata_id ) )
-			# we don't have the homepage because there wasn't an entry in the homepages in the sitemaps file.
-			# but if we can get one from socrata_meta, use that instead to pull IA snapshots
-			values['internet_archive_snapshots'] = ""
-			if 'soc_homepage' in values.keys():
-				values['internet_archive_snapshots'] = get_internet_archive_snapshots( values['soc_homepage'] )
-				values["homepage"] = values["soc_homepage"]
-			download_file_dict_list = parsed_download_file_dict[socrata_id]
-			for download_file_dict in download_file_dict_list: 
-				values['dataset_snapshot_filename'] =  download_file_dict['download_filename']
-				values['dataset_snapshot_dl_ts'] =  download_file_dict['download_ts']
-
-			# add the values dictionary to the ret list 
-			ret.append( values )
-	return ret
+	print("looking at homepage %s from the sitemaps file" % parsed_homepage_url)
+	logging.debug("looking at homepage %s from the sitemaps file", parsed_homepage_url)
 
+	homepage_url = parsed_homepage_url['homepage_url']
+	socrata_id = parsed_homepage_url['socrata_id']
 
-def is_socrata_id(input_string):
-	"""
-	is this string formatted like a socrata id? returns True or False.
-	"""
-
-	pattern = r"^[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}$"
-    
-	if re.match(pattern, input_string):
-		return True
-	else:
-		return False
-
+	# not a dataset home page? just skip.
+	if not socrata_id:
+		logging.info("could not find a socrata id in %s; assuming this is not a dataset homepage and skipping to the next entry", parsed_homepage_url)
+		return []
 
+	values = {}
+	values['socrata_id'] = socrata_id
+	values['homepage'] = homepage_url
 
-results_dict = {}
-parsed_download_file_dict = build_download_file_dict()
-download_files_processed = {} # keep track of what we matched so we can process unmatched ones separately
+	# find the IA snapshots of this homepage, then the socrata metadata associated with the socrata id.
+	# the socrata prefetch is already running alongside the IA lookups, so this just waits for it to finish
+	values['internet_archive_snapshots'] = await get_internet_archive_snapshots( client, homepage_url )
+	await socrata_task
+	values.update( get_socrata_data( socrata_id ) )
 
-with open(sitemap_data_fname,'r') as inputf:
+	# lastly, look for the matching downloaded dataset file
+	if not socrata_id in parsed_download_file_dict:
+		logging.info("could not find a download file with a matching socrata id %s in %s???", socrata_id,downloads_fname)
+		values['dataset_snapshot_filename'] =  ""
+		values['dataset_snapshot_dl_ts'] =  ""
+		return [ values ]
 
-	logging.info("getting dataset homepages out of the sitemaps file: %s" % sitemap_data_fname)
-	while True:
+	download_file_dict_list = parsed_download_file_dict[ socrata_id ]
+	logging.debug("matched homepage %s to download file(s) %s ", parsed_homepage_url['homepage_url'],download_file_dict_list)
+	download_files_processed[ socrata_id ] = True 	# keep track of these so we can process the leftovers later 
 
-		parsed_homepage_url = get_next_homepage_url_line( inputf )
-		print("looking at homepage %s from the sitemaps file" % parsed_homepage_url)
-		logging.debug("looking at homepage %s from the sitemaps file" % parsed_homepage_url)
-		if not parsed_homepage_url:
-			logging.info("finished looking at dataset homepages from the sitemaps file %s" % sitemap_data_fname)
-			break
+	return values_per_download_file( values, download_file_dict_list )
 
-		homepage_url = parsed_homepage_url['homepage_url']
-		socrata_id = parsed_homepage_url['socrata_id']
+def values_per_download_file( values, download_file_dict_list ):
+	"""
+	a socrata id can have been downloaded more than once. returns a list with a copy of the values dictionary
+	for each download file, with that file's name and download timestamp filled in.
+	"""
+	ret = []
+	for download_file_dict in download_file_dict_list: 
+		download_values = dict( values )
+		download_values['dataset_snapshot_filename'] =  download_file_dict['download_filename']
+		download_values['dataset_snapshot_dl_ts'] =  download_file_dict['download_ts']
+		ret.append( download_values )
+	return ret
 
-		# not a dataset home page? just skip.
-		if not socrata_id:
-			logging.info("could not find a socrata id in %s; assuming this is not a dataset homepage and skipping to the next entry" % parsed_homepage_url)
-			continue
+async def process_leftover_download_file( client, socrata_id ):
+	"""
+	look up what we can for a downloaded file that didn't have a homepage in the sitemaps file.
+	returns a list of values dictionaries, one per download file with this socrata id.
+	"""
+	logging.error("download file %s not in dataset home page file. going to process what we can still get now.", socrata_id)
+	values = {}
+	values['socrata_id'] = socrata_id
+	values['homepage'] = ""
+	values.update( get_socrata_data( socrata_id ) )
+	# we don't have the homepage because there wasn't an entry in the homepages in the sitemaps file.
+	# but if we can get one from socrata_meta, use that instead to pull IA snapshots
+	values['internet_archive_snapshots'] = ""
+	if values['soc_homepage']:
+		values['internet_archive_snapshots'] = await get_internet_archive_snapshots( client, values['soc_homepage'] )
+		values["homepage"] = values["soc_homepage"]
+	return values_per_download_file( values, parsed_download_file_dict[socrata_id] )
+
+async def process_leftover_download_files( client, parsed_download_file_dict, download_files_processed ):
+	"""
+	some datasets in the download file might not have corresponding entry in the datasets homepages in the sitemaps file.
+	process these "leftover" files separately
+	"""
+	leftover_ids = [ socrata_id for socrata_id in parsed_download_file_dict if socrata_id not in download_files_processed ]
+	return await asyncio.gather( *[ process_leftover_download_file( client, socrata_id ) for socrata_id in leftover_ids ] )
 
-		values = {}
-		values['socrata_id'] = socrata_id
-		values['homepage'] = homepage_url
+async def process_homepages( homepages ):
+	"""
+	look up every homepage from the sitemaps file concurrently, then the leftover download files.
+	returns a tuple of (list of homepage values dictionaries, list of leftover values dictionaries), with one
+	values dictionary per download file
+	"""
+	async with httpx.AsyncClient( http2=True, timeout=http_timeout_secs, limits=http_limits, headers=http_headers, follow_redirects=True ) as client:
+		# look up the socrata metadata for every id we know about in batches, alongside the IA lookups
+		socrata_ids = { h['socrata_id'] for h in homepages if h['socrata_id'] } | set( parsed_download_file_dict )
+		socrata_task = asyncio.create_task( prefetch_socrata_data( client, socrata_ids ) )
 
-		# find the IA snapshots of this homepage
-		values['internet_archive_snapshots'] = get_internet_archive_snapshots( homepage_url )
+		homepage_values_lists = await asyncio.gather( *[ process_homepage( client, socrata_task, h ) for h in homepages ] )
+		# the leftovers depend on which download files the homepages matched, so these go second
+		await socrata_task
+		leftover_downloads_lists = await process_leftover_download_files( client, parsed_download_file_dict, download_files_processed )
+	homepage_values_list = [ values for values_list in homepage_values_lists for values in values_list ]
+	leftover_downloads_list = [ values for values_list in leftover_downloads_lists for values in values_list ]
+	return homepage_values_list, leftover_downloads_list
 
-		# find the socrata metadata associated with the socrata id
-		values.update( get_socrata_data( socrata_id ) )
 
-		# lastly, look for the matching downloaded dataset file
-		download_file_dict_list = []
-		if not socrata_id in parsed_download_file_dict.keys():
-			logging.info("could not find a download file with a matching socrata id %s in %s???" % (socrata_id,downloads_fname))
-			values['dataset_snapshot_filename'] =  ""
-			values['dataset_snapshot_dl_ts'] =  ""
-		else:
-			download_file_dict_list = parsed_download_file_dict[ socrata_id ]
-			logging.debug("matched homepage %s to download file(s) %s " % (parsed_homepage_url['homepage_url'],download_file_dict_list))
-			download_files_processed[ socrata_id ] = True 	# keep track of these so we can process the leftovers later 
+def is_socrata_id(input_string):
+	"""
+	is this string formatted like a socrata id? returns True or False.
+	"""
+	return socrata_id_pattern.match(input_string) is not None
 
-			for download_file_dict in download_file_dict_list: 
-				values['dataset_snapshot_filename'] =  download_file_dict['download_filename']
-				values['dataset_snapshot_dl_ts'] =  download_file_dict['download_ts']
 
-		# add the values dictionary to the results_dict
-		if values['soc_name'] in results_dict.keys():
-			results_dict[ values['soc_name'] ].append( values )
-		else:
-			results_dict[ values['soc_name'] ] = [  values ]
 
-		time.sleep(10)
+results_dict = defaultdict(list)
+parsed_download_file_dict = build_download_file_dict()
+download_files_processed = {} # keep track of what we matched so we can process unmatched ones separately
 
-# there might be some files in the download list that weren't in the homepage list in the sitemaps file
-# go get the matching data for them and add to the results_dict
-leftover_downloads_list = process_leftover_download_files(parsed_download_file_dict,download_files_processed)
-for leftover_downloads in leftover_downloads_list:
-	if leftover_downloads['soc_name'] in results_dict.keys():
-		results_dict[ leftover_downloads['soc_name'] ].append( leftover_downloads )
-	else:
-		results_dict[ leftover_downloads['soc_name'] ] = [  leftover_downloads ]
+# read all the homepages in first so we can look them up concurrently
+with open(sitemap_data_fname,'r',newline='') as inputf:
 
+	logging.info("getting dataset homepages out of the sitemaps file: %s", sitemap_data_fname)
+	homepages = list( get_homepage_urls( inputf ) )
+	logging.info("finished reading dataset homepages from the sitemaps file %s", sitemap_data_fname)
 
-# output the results
-with open('dataset_documentation.csv', mode='w', newline='') as outputf:
-	csv_writer = csv.writer(outputf)
-	for hl in header_lines:
-		csv_writer.writerow([hl])
-	csv_writer.writerow(["dataset name","socrata id","download filename","downloaded ts","dataset homepage","description","Internet Archive snapshots","addtl socrata metadata"])
+# there might be some files in the download list that weren't in the homepage list in the sitemaps file;
+# those get looked up as leftovers once the homepages are done
+homepage_values_list, leftover_downloads_list = asyncio.run( process_homepages( homepages ) )
 
-	# for every dataset name ...
-	for name in sorted( results_dict.keys() ):
+for values in homepage_values_list:
+	# add the values dictionary to the results_dict
+	results_dict[ values['soc_name'] ].append( values )
 
-		# ... ordered by socrata id ...
-		sorted_datasets = sorted(results_dict[name], key=lambda x: x['socrata_id'])
+# add the matching data for the leftovers to the results_dict
+for leftover_downloads in leftover_downloads_list:
+	results_dict[ leftover_downloads['soc_name'] ].append( leftover_downloads )
 
-		# ... print out a row with the dataset's information
-		for ds in sorted_datasets:
-			csv_writer.writerow([name,ds['socrata_id'],ds['dataset_snapshot_filename'], \
-				ds['dataset_snapshot_dl_ts'], ds['homepage'], ds['soc_description'], ds['internet_archive_snapshots'],
-				ds['socrata_meta']])
 
+# build the output rows: for every dataset name, ordered by socrata id, a row with the dataset's information
+rows = [ [hl] for hl in header_lines ]
+rows.append(["dataset name","socrata id","download filename","downloaded ts","dataset homepage","description","Internet Archive snapshots","addtl socrata metadata"])
+rows.extend( [name,ds['socrata_id'],ds['dataset_snapshot_filename'], \
+		ds['dataset_snapshot_dl_ts'], ds['homepage'], ds['soc_description'], ds['internet_archive_snapshots'],
+		ds['socrata_meta']]
+	for name in sorted( results_dict )
+	for ds in sorted(results_dict[name], key=itemgetter('socrata_id')) )
 
+# output the results
+with open(output_fname, mode='wb', buffering=output_buffer_size) as rawf, \
+	gzip.open(rawf, mode='wt', newline='', compresslevel=output_compresslevel) as outputf:
+	csv_writer = csv.writer(outputf)
+	csv_writer.writerows(rows)